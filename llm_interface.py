@@ -1,23 +1,241 @@
 # llm_interface.py
+import os
 import re
+import time
 import random
-from dataclasses import dataclass
-from typing import Optional
+import shutil
+import sqlite3
+import zlib
+import hashlib
+import tempfile
+import threading
+import subprocess
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Callable, Iterator, List, Optional
 
 from PyQt5.QtCore import QObject, pyqtSignal, pyqtSlot
 
+from semantic_cache import GenCache
+
 try:
-    from llama_cpp import Llama
+    from llama_cpp import Llama, LlamaRAMCache
 except Exception:  # package not present or failed to import
     Llama = None
+    LlamaRAMCache = None
+
+try:
+    import numpy as np
+    from llama_cpp.llama_speculative import LlamaDraftModel
+except Exception:  # older llama-cpp-python; only speculative decoding is lost
+    np = None
+    LlamaDraftModel = object  # keeps LlamaModelDraft importable; never instantiated
+
+try:
+    import psutil
+except Exception:  # optional; only used to count physical cores
+    psutil = None
+
+
+_WS_RE = re.compile(r"\s+")
+_STRIP_PUNCT = re.compile(r"[^\w\s\-]")
+_SENTENCE_END = re.compile(r"[.!?]\s")
+_DUMMY_SAMPLES = (
+    "The mind wanders like a loose thread, catching on unrelated memories until a small story forms.",
+    "I trace the edges of an idea and find it mirrors the ordinary: a kettle, a key, a cat in a sunbeam.",
+    "Between cause and effect there is a hallway of choices; today I walk it slowly, counting the doors.",
+)
+# Precision tag at the end of a GGUF file name, e.g. "-f16.gguf" or "-q5_k_m.gguf"
+_QUANT_SUFFIX = re.compile(r"[-_.](f32|f16|bf16|q\d\w*)(?=\.gguf$)", re.IGNORECASE)
+
+
+def physical_cores() -> int:
+    """Best guess at physical core count (SMT siblings only add contention for decode)."""
+    n = psutil.cpu_count(logical=False) if psutil is not None else None
+    if not n:
+        n = (os.cpu_count() or 2) // 2
+    return max(1, n)
 
 
 @dataclass
 class LLMConfig:
     model_path: str
     n_ctx: int = 4096
-    n_threads: int = 4
-    n_gpu_layers: int = 0   # set >0 if using cuBLAS build
+    n_threads: int = field(default_factory=physical_cores)        # per-token decode
+    n_threads_batch: int = field(default_factory=physical_cores)  # prompt processing
+    use_mlock: bool = True  # pin weights so they aren't paged out and re-faulted
+    use_mmap: bool = True
+    n_gpu_layers: int = 0   # set >0 (or -1 for all layers) if using cuBLAS build
+    main_gpu: int = 0
+    n_batch: int = 512      # prompt-processing batch size
+    tensor_split: Optional[List[float]] = None  # per-GPU split for multi-GPU hosts
+    temperature: float = 0.8
+    top_p: float = 0.95
+    cache_path: Optional[str] = None  # SQLite file for persistent response cache
+    cache_size: int = 128             # in-process LRU entries
+    kv_cache_bytes: int = 0           # RAM for saved KV states (prefix reuse); 0 disables
+    quantization: Optional[str] = None     # e.g. "Q4_K_M"; built from an f16/f32 GGUF once
+    quantize_bin: str = "llama-quantize"   # llama.cpp quantize tool (older builds: "quantize")
+    speculative: bool = False               # draft tokens with a small model, verify with the main one
+    draft_model_path: Optional[str] = None  # must share the main model's tokenizer
+    num_pred_tokens: int = 5
+
+
+def ensure_quantized(model_path: str, quant: Optional[str], quantize_bin: str = "llama-quantize",
+                     should_stop: Optional[Callable[[], bool]] = None) -> str:
+    """Return the path of a `quant` variant of model_path, building it once if needed.
+
+    Falls back to model_path when the source is already quantized to another
+    type, the quantize tool isn't available, or should_stop() turns true
+    while it runs.
+    """
+    if not quant or not model_path:
+        return model_path
+    d, base = os.path.split(model_path)
+    m = _QUANT_SUFFIX.search(base)
+    src_quant = m.group(1).lower() if m else ""
+    if src_quant == quant.lower():
+        return model_path
+    stem = base[:m.start()] if m else os.path.splitext(base)[0]
+    if src_quant not in ("", "f32", "f16", "bf16"):
+        print(f"[LLMInterface] {base} is already quantized; not re-quantizing to {quant}.")
+        return model_path
+    target = os.path.join(d, f"{stem}-{quant}.gguf")
+    if os.path.exists(target):
+        return target
+    binary = shutil.which(quantize_bin)
+    if binary is None:
+        print(f"[LLMInterface] {quantize_bin} not found; using {base} as is.")
+        return model_path
+    print(f"[LLMInterface] Quantizing {base} to {quant} (one-time)…")
+    # Write beside the target and rename on success, so an interrupted run
+    # never leaves a truncated file that later starts would pick up
+    fd, tmp = tempfile.mkstemp(prefix=f".{stem}-{quant}.", suffix=".part", dir=d or ".")
+    os.close(fd)
+    try:
+        proc = subprocess.Popen([binary, model_path, tmp, quant])
+        while True:
+            try:
+                rc = proc.wait(timeout=0.5)
+                break
+            except subprocess.TimeoutExpired:
+                if should_stop is not None and should_stop():
+                    proc.terminate()
+                    try:
+                        proc.wait(timeout=5)
+                    except subprocess.TimeoutExpired:
+                        proc.kill()
+                        proc.wait()
+                    print("[LLMInterface] Quantization interrupted.")
+                    return model_path
+        if rc != 0:
+            raise subprocess.CalledProcessError(rc, binary)
+        os.replace(tmp, target)
+    except Exception as e:
+        print(f"[LLMInterface] Quantization failed: {e}")
+        return model_path
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    return target
+
+
+class ResponseCache:
+    """Exact-match prompt cache: in-process LRU backed by an optional SQLite table."""
+    def __init__(self, path: Optional[str] = None, max_items: int = 128, max_rows: int = 1000):
+        self.max_items = max(1, int(max_items))
+        self._mem: "OrderedDict[str, str]" = OrderedDict()
+        self._db = None
+        if path:
+            try:
+                d = os.path.dirname(os.path.abspath(path))
+                os.makedirs(d, exist_ok=True)
+                self._db = sqlite3.connect(path)
+                self._db.execute(
+                    "CREATE TABLE IF NOT EXISTS responses "
+                    "(key TEXT PRIMARY KEY, text BLOB, ts INTEGER)"
+                )
+                # Keep only the newest max_rows entries
+                self._db.execute(
+                    "DELETE FROM responses WHERE key NOT IN "
+                    "(SELECT key FROM responses ORDER BY ts DESC LIMIT ?)",
+                    (max(1, int(max_rows)),),
+                )
+                self._db.commit()
+            except Exception as e:
+                print(f"[ResponseCache] Persistent cache disabled: {e}")
+                self._db = None
+
+    @staticmethod
+    def make_key(*parts) -> str:
+        return hashlib.sha256("|".join(str(p) for p in parts).encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        if key in self._mem:
+            self._mem.move_to_end(key)
+            return self._mem[key]
+        if self._db is not None:
+            try:
+                row = self._db.execute("SELECT text FROM responses WHERE key = ?", (key,)).fetchone()
+            except Exception as e:
+                print(f"[ResponseCache] Lookup error: {e}")
+                row = None
+            if row is not None:
+                self._remember(key, row[0])
+                return row[0]
+        return None
+
+    def put(self, key: str, text: str):
+        self._remember(key, text)
+        if self._db is not None:
+            try:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO responses (key, text, ts) VALUES (?, ?, ?)",
+                    (key, text, int(time.time())),
+                )
+                self._db.commit()
+            except Exception as e:
+                print(f"[ResponseCache] Store error: {e}")
+
+    def _remember(self, key: str, text: str):
+        self._mem[key] = text
+        self._mem.move_to_end(key)
+        while len(self._mem) > self.max_items:
+            self._mem.popitem(last=False)
+
+
+class LlamaModelDraft(LlamaDraftModel):
+    """Speculative-decoding drafter backed by a small Llama.
+
+    llama-cpp-python only ships a prompt-lookup drafter; this one greedily
+    predicts the next tokens with a second model. The main model verifies
+    them in a single batch, so output is unchanged.
+    """
+    def __init__(self, llm: "Llama", num_pred_tokens: int = 5):
+        self.llm = llm
+        self.num_pred_tokens = max(1, int(num_pred_tokens))
+
+    def __call__(self, input_ids, /, **kwargs):
+        d = self.llm
+        # Keep the draft KV cache for the prefix it shares with the main sequence
+        seen = d.input_ids[: d.n_tokens]
+        lim = min(len(seen), len(input_ids))
+        diff = np.nonzero(seen[:lim] != input_ids[:lim])[0]
+        n = int(diff[0]) if diff.size else lim
+        # At least one token must be evaluated to get fresh logits
+        d.n_tokens = min(n, len(input_ids) - 1)
+        d.eval(input_ids[d.n_tokens:].tolist())
+        out = []
+        for i in range(self.num_pred_tokens):
+            if d.n_tokens >= d.n_ctx():
+                break
+            tok = d.sample(temp=0.0)
+            if tok == d.token_eos():
+                break
+            out.append(tok)
+            if i + 1 < self.num_pred_tokens:
+                d.eval([tok])
+        return np.array(out, dtype=np.intc)
 
 
 class LLMInterface:
@@ -26,14 +244,29 @@ class LLMInterface:
         self.cfg = cfg
         self._llm = None
         self._available = False
+        self._cache = ResponseCache(cfg.cache_path, cfg.cache_size)
+        # True when the last generate_stream produced a full real-model completion
+        self.last_complete = False
         if Llama is not None and cfg.model_path:
             try:
                 self._llm = Llama(
                     model_path=cfg.model_path,
                     n_ctx=cfg.n_ctx,
                     n_threads=cfg.n_threads,
+                    n_threads_batch=cfg.n_threads_batch,
+                    use_mlock=cfg.use_mlock,
+                    use_mmap=cfg.use_mmap,
                     n_gpu_layers=cfg.n_gpu_layers,
+                    main_gpu=cfg.main_gpu,
+                    n_batch=cfg.n_batch,
+                    tensor_split=cfg.tensor_split,
+                    draft_model=self._load_draft(cfg),
                 )
+                if LlamaRAMCache is not None and cfg.kv_cache_bytes > 0:
+                    # Saved states are matched on longest token prefix. This only pays off
+                    # when a prompt prefix recurs within one run; every completion also
+                    # pays for a full state copy, hence off by default
+                    self._llm.set_cache(LlamaRAMCache(capacity_bytes=cfg.kv_cache_bytes))
                 self._available = True
             except Exception as e:
                 print(f"[LLMInterface] Failed to load model: {e}")
@@ -43,70 +276,226 @@ class LLMInterface:
     def available(self) -> bool:
         return self._available
 
-    def generate(self, prompt: str, max_tokens: int = 512) -> str:
+    @staticmethod
+    def _load_draft(cfg: LLMConfig) -> Optional[LlamaModelDraft]:
+        if not cfg.speculative or not cfg.draft_model_path:
+            return None
+        if LlamaDraftModel is object:
+            print("[LLMInterface] llama_cpp.llama_speculative not available; speculative decoding off.")
+            return None
+        try:
+            draft = Llama(
+                model_path=cfg.draft_model_path,
+                n_ctx=cfg.n_ctx,
+                n_threads=cfg.n_threads,
+                n_threads_batch=cfg.n_threads_batch,
+                n_gpu_layers=cfg.n_gpu_layers,
+                main_gpu=cfg.main_gpu,
+                verbose=False,
+            )
+        except Exception as e:
+            print(f"[LLMInterface] Failed to load draft model; speculative decoding off: {e}")
+            return None
+        return LlamaModelDraft(draft, cfg.num_pred_tokens)
+
+    def generate(self, prompt: str, max_tokens: int = 512, bypass_cache: bool = False,
+                 should_stop: Optional[Callable[[], bool]] = None) -> str:
+        return "".join(self.generate_stream(prompt, max_tokens, bypass_cache, should_stop)).strip()
+
+    def generate_stream(self, prompt: str, max_tokens: int = 512, bypass_cache: bool = False,
+                        should_stop: Optional[Callable[[], bool]] = None) -> Iterator[str]:
+        """Yield the completion piece by piece as llama.cpp decodes it.
+
+        should_stop is polled once per token; when it returns True the stream
+        ends early and the partial text is not cached.
+        """
+        self.last_complete = False
         if not self._available:
-            return self._dummy_generate(prompt)
+            yield self._dummy_generate(prompt)
+            return
+        key = ResponseCache.make_key(
+            prompt, max_tokens, self.cfg.temperature, self.cfg.top_p, self.cfg.model_path
+        )
+        if not bypass_cache:
+            cached = self._cache.get(key)
+            if cached is not None:
+                self.last_complete = True
+                yield cached
+                return
+        parts = []
         try:
-            out = self._llm(
+            # Leave headroom so the completion never overflows the context window
+            n_prompt = len(self._llm.tokenize(prompt.encode("utf-8")))
+            budget = max(1, min(max_tokens, self.cfg.n_ctx - n_prompt - 32))
+            for out in self._llm(
                 prompt=prompt,
-                max_tokens=max_tokens,
-                stop=["</END>", "###"],
-                temperature=0.8,
-                top_p=0.95,
-            )
-            return out["choices"][0]["text"].strip()
+                max_tokens=budget,
+                stop=["###", "\n\n\n"],
+                temperature=self.cfg.temperature,
+                top_p=self.cfg.top_p,
+                stream=True,
+            ):
+                if should_stop is not None and should_stop():
+                    return
+                piece = out["choices"][0]["text"]
+                parts.append(piece)
+                yield piece
         except Exception as e:
             print(f"[LLMInterface] Generation error: {e}")
-            return self._dummy_generate(prompt)
+            if not parts:
+                yield self._dummy_generate(prompt)
+            # Never cache a partial completion
+            return
+        text = "".join(parts).strip()
+        if text:
+            if not bypass_cache:
+                self._cache.put(key, text)
+            self.last_complete = True
 
-    def generate_topic(self) -> str:
+    def generate_topic(self, should_stop: Optional[Callable[[], bool]] = None) -> str:
         topic_prompt = (
             "You are a random topic generator. Return ONE short topic only (3-6 words), "
             "no punctuation, no quotes. Example: amusement parks\nTopic:"
         )
-        raw = self.generate(topic_prompt, max_tokens=24)
+        # The prompt is constant, so a cache hit would pin every persona to the same topic
+        raw = self.generate(topic_prompt, max_tokens=24, bypass_cache=True, should_stop=should_stop)
         # sanitize to a short line
-        line = re.sub(r"\s+", " ", raw).strip()
-        line = re.sub(r"[^\w\s\-]", "", line)
+        line = _WS_RE.sub(" ", raw).strip()
+        line = _STRIP_PUNCT.sub("", line)
         return line[:64] if line else random.choice([
             "amusement parks", "rainy sidewalks", "old libraries", "lost satellites"
         ])
 
     @staticmethod
     def _dummy_generate(prompt: str) -> str:
-        seed = sum(ord(c) for c in prompt) % 1000
-        random.seed(seed)
-        samples = [
-            "The mind wanders like a loose thread, catching on unrelated memories until a small story forms.",
-            "I trace the edges of an idea and find it mirrors the ordinary: a kettle, a key, a cat in a sunbeam.",
-            "Between cause and effect there is a hallway of choices; today I walk it slowly, counting the doors.",
-        ]
-        return "\n\n".join(random.sample(samples, k=len(samples)))
+        # Private RNG so the fallback doesn't disturb the global one
+        rng = random.Random(zlib.crc32(prompt.encode("utf-8")))
+        return "\n\n".join(rng.sample(_DUMMY_SAMPLES, k=len(_DUMMY_SAMPLES)))
 
 
 class LLMWorker(QObject):
-    generated = pyqtSignal(str)
+    ready = pyqtSignal()               # model loaded (or dummy fallback in place)
+    chunkReady = pyqtSignal(str)       # one or more complete sentences
+    generationDone = pyqtSignal(str)   # full text (or topic) once generation ends
     status = pyqtSignal(str)
     error = pyqtSignal(str)
 
-    def __init__(self, llm: LLMInterface):
+    def __init__(self, cfg: LLMConfig, gencache_cfg: Optional[dict] = None):
         super().__init__()
-        self.llm = llm
+        self.cfg = cfg
+        self.gencache_cfg = gencache_cfg or {}
+        self.llm: Optional[LLMInterface] = None
+        self.gencache: Optional[GenCache] = None
+        self._cancel = threading.Event()    # per request; cleared when the next one starts
+        self._shutdown = threading.Event()  # sticky; once set the worker does no more work
+
+    @pyqtSlot()
+    def init_llm(self):
+        """Load the model; invoked on the worker thread after it starts."""
+        if self._shutdown.is_set():
+            return
+        if self.cfg.quantization:
+            self.status.emit(f"Preparing {self.cfg.quantization} model…")
+            self.cfg.model_path = ensure_quantized(
+                self.cfg.model_path, self.cfg.quantization, self.cfg.quantize_bin,
+                should_stop=self._shutdown.is_set,
+            )
+            if self._shutdown.is_set():
+                return
+        self.status.emit("Loading model…")
+        self.llm = LLMInterface(self.cfg)
+        if self._shutdown.is_set():
+            return
+        if self.gencache_cfg.get("enabled", True):
+            self.gencache = GenCache(
+                os.path.expanduser(self.gencache_cfg.get("path") or "~/.xenon/gencache.sqlite"),
+                threshold=float(self.gencache_cfg.get("threshold", 0.92)),
+            )
+        self.ready.emit()
 
-    @pyqtSlot(str, int)
-    def generate(self, prompt: str, max_tokens: int = 512):
+    @pyqtSlot()
+    def cancel(self):
+        """Abort the in-flight generation at the next token.
+
+        Thread-safe; call it directly from the GUI thread. A queued call would
+        only run once the generation it is meant to stop has finished.
+        """
+        self._cancel.set()
+
+    def shutdown(self):
+        """Stop the current work and refuse any still queued; thread-safe.
+
+        Unlike cancel(), this is never cleared by the next request, so a
+        generate/gen_topic queued behind the current one can't undo it.
+        """
+        self._shutdown.set()
+        self._cancel.set()
+
+    def _should_stop(self) -> bool:
+        return self._cancel.is_set() or self._shutdown.is_set()
+
+    @pyqtSlot(str, int, str, object)
+    def generate(self, prompt: str, max_tokens: int = 512,
+                 template_id: str = "", slots: Optional[dict] = None):
+        """Stream a completion; with template_id/slots, try GenCache first."""
+        if self._shutdown.is_set():
+            return
+        if self.llm is None:
+            self.error.emit("Model not loaded yet")
+            return
+        self._cancel.clear()
         try:
+            # Cached texts are only valid for the model that produced them
+            cache_tid = f"{template_id}|{self.cfg.model_path}" if template_id else ""
+            if cache_tid and self.gencache is not None:
+                cached = self.gencache.lookup(cache_tid, slots or {})
+                if cached:
+                    self.status.emit("Reusing a similar monologue…")
+                    self.chunkReady.emit(cached)
+                    self.generationDone.emit(cached)
+                    return
+            if self._shutdown.is_set():
+                return
             self.status.emit("Generating text…")
-            text = self.llm.generate(prompt, max_tokens=max_tokens)
-            self.generated.emit(text)
+            buf = ""
+            parts = []
+            for piece in self.llm.generate_stream(prompt, max_tokens=max_tokens,
+                                                  should_stop=self._should_stop):
+                parts.append(piece)
+                buf += piece
+                # Flush everything up to the last sentence boundary seen so far
+                end = -1
+                for m in _SENTENCE_END.finditer(buf):
+                    end = m.end()
+                if end > 0:
+                    self.chunkReady.emit(buf[:end])
+                    buf = buf[end:]
+            if self._should_stop():
+                # Stopped mid-stream; nothing is reported or cached
+                return
+            if buf.strip():
+                self.chunkReady.emit(buf)
+            text = "".join(parts).strip()
+            self.generationDone.emit(text)
+            # Dummy output and truncated completions must never be served later
+            if cache_tid and self.gencache is not None and self.llm.last_complete:
+                self.gencache.insert(cache_tid, slots or {}, text)
         except Exception as e:
             self.error.emit(str(e))
 
     @pyqtSlot()
     def gen_topic(self):
+        if self._shutdown.is_set():
+            return
+        if self.llm is None:
+            self.error.emit("Model not loaded yet")
+            return
+        self._cancel.clear()
         try:
             self.status.emit("Choosing a topic…")
-            topic = self.llm.generate_topic()
-            self.generated.emit(topic)
+            topic = self.llm.generate_topic(should_stop=self._should_stop)
+            if self._should_stop():
+                return
+            self.generationDone.emit(topic)
         except Exception as e:
-            self.error.emit(str(e))
\ No newline at end of file
+            self.error.emit(str(e))
@@ -3,22 +3,21 @@ import os
 import sys
 import random
 import re
-from dataclasses import dataclass
-from typing import List, Dict, Any
+import hashlib
+from dataclasses import dataclass, field
+from typing import List, Dict, Any, Tuple
 
 import yaml
-from PyQt5.QtCore import QThread, QObject, pyqtSignal
+from PyQt5.QtCore import Qt, QThread, QObject, QTimer, QMetaObject, pyqtSignal
 from PyQt5.QtWidgets import QApplication
 
 from ui_renderer import UIRenderer
-from llm_interface import LLMInterface, LLMConfig, LLMWorker
+from llm_interface import LLMConfig, LLMWorker, physical_cores
 
 
 # ----- Chunking -----
-_SENT_RE = re.compile(r"(?<=[.!?])\s+")
-# The above pattern is intentionally broken to remind us to fix it? No! We'll make it correct below.
-
-# Correct sentence boundary splitter (kept separate to avoid accidental edits)
+_WS_RE = re.compile(r"\s+")
+# Sentence boundary splitter (keeps punctuation via lookbehind)
 _SENTENCE_SPLIT = re.compile(r"(?<=[.!?])\s+")
 
 
@@ -28,45 +27,42 @@ def split_into_sentence_chunks(text: str, max_words: int) -> List[str]:
     """
     if not text:
         return []
-    # Normalize whitespace
-    t = re.sub(r"\s+", " ", text.strip())
-    # Split into sentences using regex (keeps punctuation via lookbehind)
-    sentences = re.split(r"(?<=[.!?])\s+", t)
+    # After normalizing, words are exactly the single-space-separated runs
+    t = _WS_RE.sub(" ", text.strip())
+    sentences = _SENTENCE_SPLIT.split(t)
     chunks = []
-    cur = []
+    start = 0      # first sentence of the chunk being built
     cur_words = 0
-
-    def flush():
-        nonlocal cur, cur_words
-        if cur:
-            chunks.append(" ".join(cur).strip())
-            cur = []
-            cur_words = 0
-
-    for s in sentences:
-        w = s.split()
-        if not w:
+    for i, s in enumerate(sentences):
+        if not s:
             continue
-        if len(w) > max_words:
+        n = s.count(" ") + 1
+        if n > max_words:
             # Hard split this long sentence
-            flush()
-            for i in range(0, len(w), max_words):
-                chunks.append(" ".join(w[i:i+max_words]))
-            continue
-        if cur_words + len(w) <= max_words:
-            cur.append(s)
-            cur_words += len(w)
+            if cur_words:
+                chunks.append(" ".join(sentences[start:i]))
+            w = s.split(" ")
+            for j in range(0, n, max_words):
+                chunks.append(" ".join(w[j:j + max_words]))
+            start, cur_words = i + 1, 0
+        elif cur_words + n <= max_words:
+            if not cur_words:
+                start = i
+            cur_words += n
         else:
-            flush()
-            cur = [s]
-            cur_words = len(w)
-    flush()
+            chunks.append(" ".join(sentences[start:i]))
+            start, cur_words = i, n
+    if cur_words:
+        chunks.append(" ".join(sentences[start:]))
     return chunks
 
 
 # ----- Persona prompt builder -----
+MONOLOGUE_TEMPLATE_ID = "monologue-v2"
+
 
-def build_prompt(persona: Dict[str, Any], topic: str) -> str:
+def render_persona_prefix(persona: Dict[str, Any]) -> str:
+    """Render the topic-independent part of the monologue prompt."""
     persona_txt = persona.get("prompt_persona", "").strip()
     style_rules = persona.get("style_rules", [])
     examples = persona.get("examples", [])
@@ -75,8 +71,7 @@ def build_prompt(persona: Dict[str, Any], topic: str) -> str:
     ex = "\n".join(f"• {e}" for e in examples)
 
     # Simple instruction template (chatty but single-shot)
-    return f"""
-You adopt the following voice:
+    return f"""You adopt the following voice:
 {persona_txt}
 
 Style rules:
@@ -87,10 +82,19 @@ Examples of the voice:
 
 Now, reflect in 2–4 paragraphs about the topic below in that voice. Do not include headings. Avoid bullet lists. Conclude with a crisp image or turn of phrase.
 
-Topic: {topic}
+Topic: """
 
-</END>
-""".strip()
+
+def build_prompt(persona: Dict[str, Any], topic: str) -> Tuple[str, str, Dict[str, str]]:
+    """Return (prompt, template_id, slots); the slots identify the prompt for GenCache."""
+    prefix = persona.get("_rendered_prefix")
+    if prefix is None:
+        prefix = render_persona_prefix(persona)
+    # Key on the rendered voice too, so editing a persona in config.yaml
+    # stops GenCache serving monologues written in the old voice
+    voice = hashlib.sha256(prefix.encode("utf-8")).hexdigest()[:16]
+    slots = {"persona": f"{persona.get('name', '')}@{voice}", "topic": topic}
+    return (prefix + topic).rstrip(), MONOLOGUE_TEMPLATE_ID, slots
 
 
 # ----- App Controller -----
@@ -99,9 +103,15 @@ class PersonaState:
     persona: Dict[str, Any]
     topic: str = ""
     text: str = ""
+    template_id: str = ""
+    slots: Dict[str, str] = field(default_factory=dict)
 
 
 class AppController(QObject):
+    # Requests to the worker; emitted so they run queued on the worker's thread
+    topicRequested = pyqtSignal()
+    textRequested = pyqtSignal(str, int, str, object)
+
     def __init__(self, cfg: Dict[str, Any], ui: UIRenderer, worker: LLMWorker):
         super().__init__()
         self.cfg = cfg
@@ -111,26 +121,58 @@ class AppController(QObject):
         self.persona_states: List[PersonaState] = []
         self._idx = -1
         self._awaiting = None  # 'topic' | 'text'
+        self._pending = ""     # streamed text not yet packed into a full chunk
+        self._streamed = 0     # chunks handed to the UI for the current persona
+        self._llm_ready = False
+        self._started = False
+        self._assets: Dict[str, str] = {}  # file name -> absolute path, scanned once
 
         # Wire signals
-        self.worker.generated.connect(self._on_worker_generated)
+        self.worker.chunkReady.connect(self._on_worker_chunk)
+        self.worker.generationDone.connect(self._on_worker_generated)
         self.worker.status.connect(self.ui.show_status)
         self.worker.error.connect(self._on_worker_error)
+        self.worker.ready.connect(self._on_worker_ready)
+        self.topicRequested.connect(self.worker.gen_topic)
+        self.textRequested.connect(self.worker.generate)
         self.ui.chunkPlaybackFinished.connect(self._on_chunk_finished)
 
     def start(self):
         ui_cfg = self.cfg.get("ui", {})
-        startup_img = os.path.join("assets", "startup.jpg")
-        self.ui.set_background(startup_img if os.path.exists(startup_img) else None)
-        self.ui.show_status("App started… Initializing LLM…")
+        self._scan_assets()
+        self.ui.set_background(self._assets.get("startup.jpg"))
         self._prepare_personas()
-        self._next_persona()
+        self._started = True
+        if self._llm_ready:
+            self._next_persona()
+        else:
+            self.ui.show_status("Loading model…")
+
+    def _on_worker_ready(self):
+        self._llm_ready = True
+        if self._started:
+            self._next_persona()
+
+    def _scan_assets(self, root: str = "assets"):
+        # One directory listing up front instead of a stat per persona transition
+        try:
+            names = os.listdir(root)
+        except OSError:
+            names = []
+        self._assets = {}
+        for name in names:
+            path = os.path.abspath(os.path.join(root, name))
+            if os.path.isfile(path):
+                self._assets[name] = path
 
     def _prepare_personas(self):
         plist = list(self.cfg.get("personalities", []))
         random.shuffle(plist)
         n = int(self.cfg.get("num_characters", 1))
         plist = plist[: max(1, n)]
+        for p in plist:
+            # Same text for every topic, so the prompt prefix is rendered once per persona
+            p["_rendered_prefix"] = render_persona_prefix(p)
         self.persona_states = [PersonaState(p) for p in plist]
 
     def _next_persona(self):
@@ -141,37 +183,67 @@ class AppController(QObject):
         st = self.persona_states[self._idx]
         p = st.persona
         # Background and balloon geometry
-        img = os.path.join("assets", p.get("image_file_name", ""))
-        self.ui.set_background(img if os.path.exists(img) else None)
+        self.ui.set_background(self._assets.get(p.get("image_file_name", "")))
+        # Warm the next persona's background while this one generates
+        if self._idx + 1 < len(self.persona_states):
+            nxt = self.persona_states[self._idx + 1].persona
+            self.ui.preload_background(self._assets.get(nxt.get("image_file_name", "")))
 
         rect = p.get("speech_balloon", {"x_pos": 80, "y_pos": 80, "width": 864, "height": 560})
         self.ui.set_balloon_rect_design(rect.get("x_pos", 80), rect.get("y_pos", 80), rect.get("width", 864), rect.get("height", 560))
 
         self.ui.show_status(f"Persona: {p.get('display_name', p.get('name','?'))} — choosing topic…")
         self._awaiting = 'topic'
-        self.worker.gen_topic()
+        self.topicRequested.emit()
 
     def _on_worker_generated(self, text: str):
         if self._awaiting == 'topic':
             st = self.persona_states[self._idx]
             st.topic = text if text else "amusement parks"
             self.ui.show_status(f"Topic: {st.topic} — generating monologue…")
-            prompt = build_prompt(st.persona, st.topic)
+            prompt, st.template_id, st.slots = build_prompt(st.persona, st.topic)
             self._awaiting = 'text'
-            self.worker.generate(prompt, max_tokens=700)
+            self._pending = ""
+            self._streamed = 0
+            self.ui.begin_stream()
+            self.textRequested.emit(prompt, 700, st.template_id, st.slots)
         elif self._awaiting == 'text':
             st = self.persona_states[self._idx]
             st.text = text
+            # Flush whatever is left and let playback run to completion
+            self._push_chunks(split_into_sentence_chunks(self._pending, self._max_words(st)))
+            self._pending = ""
+            self.ui.show_status(f"Displaying {self._streamed} chunks…")
+            # Clear first: end_stream may finish playback synchronously and
+            # start the next persona, which sets _awaiting itself
+            self._awaiting = None
+            self.ui.end_stream()
+
+    def _on_worker_chunk(self, text: str):
+        if self._awaiting != 'text':
+            return
+        st = self.persona_states[self._idx]
+        self._pending = f"{self._pending} {text}"
+        chunks = split_into_sentence_chunks(self._pending, self._max_words(st))
+        # The last chunk may still grow with the next sentences; hold it back
+        self._pending = chunks.pop() if chunks else ""
+        self._push_chunks(chunks)
+
+    def _push_chunks(self, chunks: List[str]):
+        if not chunks:
+            return
+        if self._streamed == 0:
             # Show ready background (optional)
-            ready = os.path.join("assets", "ready.jpg")
-            if os.path.exists(ready):
+            ready = self._assets.get("ready.jpg")
+            if ready:
                 self.ui.set_background(ready)
-            # Chunk & play
-            mw = int(st.persona.get("max_words_per_chunk", 120))
-            chunks = split_into_sentence_chunks(st.text, max(40, mw))
-            self.ui.show_status(f"Displaying {len(chunks)} chunks…")
-            self.ui.play_chunks(chunks)
-            self._awaiting = None
+        for c in chunks:
+            self.ui.append_chunk(c)
+        self._streamed += len(chunks)
+
+    @staticmethod
+    def _max_words(st: PersonaState) -> int:
+        return max(40, int(st.persona.get("max_words_per_chunk", 120)))
 
     def _on_chunk_finished(self):
         self.ui.show_status("Persona finished. Moving on…")
@@ -179,6 +251,11 @@ class AppController(QObject):
 
     def _on_worker_error(self, msg: str):
         self.ui.show_status(f"Error: {msg}")
+        if self._awaiting == 'text' and self._streamed:
+            # Let the chunks already on screen finish; playback end advances
+            self._awaiting = None
+            self.ui.end_stream()
+            return
         # Skip to next persona on error
         self._next_persona()
 
@@ -197,32 +274,51 @@ def main():
     ui = UIRenderer(cfg.get('ui', {}))
     ui.show()
 
-    # LLM init on main thread (reused in worker)
+    llm_opts = cfg.get('llm', {})
+    # null keeps the response cache in memory only
+    cache_path = llm_opts.get('cache_path', '~/.xenon/llm_cache.sqlite')
     llm_cfg = LLMConfig(
         model_path=cfg.get('model_path', ''),
         n_ctx=4096,
-        n_threads=4,
-        n_gpu_layers=0,
+        n_threads=int(llm_opts.get('n_threads') or physical_cores()),
+        n_threads_batch=int(llm_opts.get('n_threads_batch') or physical_cores()),
+        use_mlock=bool(llm_opts.get('use_mlock', True)),
+        use_mmap=bool(llm_opts.get('use_mmap', True)),
+        n_gpu_layers=int(llm_opts.get('n_gpu_layers', 0)),
+        main_gpu=int(llm_opts.get('main_gpu', 0)),
+        n_batch=int(llm_opts.get('n_batch', 512)),
+        tensor_split=llm_opts.get('tensor_split'),
+        cache_path=os.path.expanduser(cache_path) if cache_path else None,
+        kv_cache_bytes=int(llm_opts.get('kv_cache_bytes') or 0),
+        quantization=llm_opts.get('quantization'),
+        quantize_bin=llm_opts.get('quantize_bin', 'llama-quantize'),
+        speculative=bool(llm_opts.get('speculative', False)),
+        draft_model_path=llm_opts.get('draft_model_path'),
+        num_pred_tokens=int(llm_opts.get('num_pred_tokens', 5)),
     )
-    llm = LLMInterface(llm_cfg)
 
-    # Long-lived worker thread
+    # Long-lived worker thread; the model is loaded there so the window paints immediately
     thread = QThread()
-    worker = LLMWorker(llm)
+    worker = LLMWorker(llm_cfg, cfg.get('gencache', {}))
     worker.moveToThread(thread)
     thread.setObjectName('llm-worker')
-    thread.start()
 
+    # Connect before the load starts so the ready signal can't be missed
     ctrl = AppController(cfg, ui, worker)
+    thread.start()
+    QMetaObject.invokeMethod(worker, "init_llm", Qt.QueuedConnection)
     QTimer.singleShot(0, ctrl.start)
 
     rc = app.exec_()
 
+    # Stop any in-flight or queued work so the worker's event loop can quit.
+    # A model load can't be interrupted, so wait for the thread however long
+    # that takes rather than destroy it while it is still running.
+    worker.shutdown()
     thread.quit()
-    thread.wait(2000)
+    thread.wait()
     sys.exit(rc)
 
 
 if __name__ == '__main__':
-    from PyQt5.QtCore import QTimer
     main()
\ No newline at end of file
@@ -0,0 +1,104 @@
+# semantic_cache.py
+import os
+import time
+import sqlite3
+import importlib.util
+from typing import Dict, List, Optional, Tuple
+
+try:
+    import numpy as np
+except Exception:  # optional dependency not installed
+    np = None
+
+
+def _have_sentence_transformers() -> bool:
+    # Checked without importing: the import pulls in torch and takes seconds
+    return np is not None and importlib.util.find_spec("sentence_transformers") is not None
+
+
+class GenCache:
+    """Template-aware generation cache.
+
+    Prompts built from the same template differ only in their slots, so a
+    stored monologue is reused when the persona matches exactly and the topic
+    embedding is close enough (cosine >= threshold). Entries persist in SQLite;
+    matching is a brute-force dot product over normalized vectors, which is
+    plenty for the few hundred entries this app accumulates.
+
+    Embedding is slow, so this is meant to be used from the LLM worker thread.
+    """
+    def __init__(self, path: str, threshold: float = 0.92,
+                 model_name: str = "sentence-transformers/all-MiniLM-L6-v2"):
+        self.threshold = float(threshold)
+        self.model_name = model_name
+        self._model = None
+        self._db = None
+        # (template_id, persona) -> (embeddings, texts)
+        self._index: Dict[Tuple[str, str], Tuple[List["np.ndarray"], List[str]]] = {}
+        if not _have_sentence_transformers():
+            print("[GenCache] sentence-transformers not available; semantic cache disabled.")
+            return
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS generations "
+                "(template_id TEXT, persona TEXT, topic TEXT, embedding BLOB, text BLOB, ts INTEGER)"
+            )
+            self._db.commit()
+            for tid, persona, emb, text in self._db.execute(
+                "SELECT template_id, persona, embedding, text FROM generations"
+            ):
+                self._add((tid, persona), np.frombuffer(emb, dtype=np.float32), text)
+        except Exception as e:
+            print(f"[GenCache] Failed to open {path}: {e}")
+            self._db = None
+
+    def available(self) -> bool:
+        return self._db is not None
+
+    def lookup(self, template_id: str, slots: Dict[str, str]) -> Optional[str]:
+        if not self.available():
+            return None
+        embs, texts = self._index.get((template_id, slots.get("persona", "")), ([], []))
+        if not embs:
+            return None
+        try:
+            q = self._embed(slots.get("topic", ""))
+        except Exception as e:
+            print(f"[GenCache] Embedding error: {e}")
+            return None
+        sims = np.stack(embs) @ q
+        best = int(np.argmax(sims))
+        return texts[best] if sims[best] >= self.threshold else None
+
+    def insert(self, template_id: str, slots: Dict[str, str], text: str):
+        if not self.available() or not text:
+            return
+        persona, topic = slots.get("persona", ""), slots.get("topic", "")
+        try:
+            emb = self._embed(topic)
+            self._db.execute(
+                "INSERT INTO generations (template_id, persona, topic, embedding, text, ts) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (template_id, persona, topic, emb.tobytes(), text, int(time.time())),
+            )
+            self._db.commit()
+        except Exception as e:
+            print(f"[GenCache] Store error: {e}")
+            return
+        self._add((template_id, persona), emb, text)
+
+    # ----- Internals -----
+    def _embed(self, s: str) -> "np.ndarray":
+        if self._model is None:
+            # Imported and loaded lazily so startup isn't paying for it
+            from sentence_transformers import SentenceTransformer
+            self._model = SentenceTransformer(self.model_name)
+        v = self._model.encode(s, normalize_embeddings=True)
+        return np.asarray(v, dtype=np.float32)
+
+    def _add(self, key: Tuple[str, str], emb: "np.ndarray", text: str):
+        embs, texts = self._index.setdefault(key, ([], []))
+        embs.append(emb)
+        texts.append(text)
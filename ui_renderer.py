@@ -1,12 +1,45 @@
 # ui_renderer.py
-import os
-from PyQt5.QtCore import Qt, QTimer, pyqtSignal, QRect, QEasingCurve, QPropertyAnimation
-from PyQt5.QtGui import QPixmap, QFont
+from collections import OrderedDict
+from PyQt5.QtCore import (
+    Qt, QTimer, pyqtSignal, QRect, QSize, QEasingCurve, QPropertyAnimation,
+    QPauseAnimation, QSequentialAnimationGroup, QObject, QRunnable, QThreadPool
+)
+from PyQt5.QtGui import QPixmap, QImage, QFont
 from PyQt5.QtWidgets import (
-    QWidget, QLabel, QVBoxLayout, QHBoxLayout, QTextBrowser, QStatusBar,
+    QWidget, QLabel, QVBoxLayout, QHBoxLayout, QStatusBar,
     QApplication, QGraphicsOpacityEffect
 )
 
+# Single-pass HTML escaping for balloon text
+_ESC_TABLE = str.maketrans({"&": "&amp;", "<": "&lt;", ">": "&gt;", "\"": "&quot;"})
+
+
+class _PixmapLoaderSignals(QObject):
+    loaded = pyqtSignal(str, QSize, QImage)
+    failed = pyqtSignal(str, QSize)
+
+
+class PixmapLoader(QRunnable):
+    """Decode and scale a background image off the GUI thread.
+
+    Emits a QImage; QPixmap may only be created on the GUI thread, so the
+    conversion happens in the receiving slot.
+    """
+    def __init__(self, path: str, size: QSize):
+        super().__init__()
+        self.path = path
+        self.size = QSize(size)
+        self.signals = _PixmapLoaderSignals()
+
+    def run(self):
+        img = QImage(self.path)
+        if img.isNull():
+            self.signals.failed.emit(self.path, self.size)
+            return
+        img = img.scaled(self.size, Qt.KeepAspectRatioByExpanding, Qt.SmoothTransformation)
+        self.signals.loaded.emit(self.path, self.size, img)
+
+
 class UIRenderer(QWidget):
     chunkPlaybackFinished = pyqtSignal()
 
@@ -38,23 +71,28 @@ class UIRenderer(QWidget):
         self.overlay_layout = QVBoxLayout(self.overlay)
         self.overlay_layout.setContentsMargins(0, 0, 0, 0)
 
-        self.balloon = QTextBrowser(self.overlay)
+        # QLabel centers rich text both ways without a per-chunk document reflow
+        self.balloon = QLabel(self.overlay)
         self.balloon.setOpenExternalLinks(False)
-        self.balloon.setReadOnly(True)
-        self.balloon.setHorizontalScrollBarPolicy(Qt.ScrollBarAlwaysOff)
-        self.balloon.setVerticalScrollBarPolicy(Qt.ScrollBarAlwaysOff)
-        self.balloon.setAlignment(Qt.AlignCenter)  # horizontal center
+        self.balloon.setTextFormat(Qt.RichText)
+        self.balloon.setWordWrap(True)
+        self.balloon.setAlignment(Qt.AlignCenter)
         # Styling
         rounding = int(self.ui_cfg.get("balloon_rounding_px", 24))
         opacity = float(self.ui_cfg.get("balloon_opacity", 0.96))
         bg_rgba = f"rgba(255,255,255,{opacity})"
         self.balloon.setStyleSheet(
-            f"QTextBrowser{{background:{bg_rgba}; border: none; border-radius:{rounding}px; padding:20px;}}"
+            f"QLabel{{background:{bg_rgba}; border: none; border-radius:{rounding}px; padding:20px;}}"
         )
         # Font
         f = QFont(self.ui_cfg.get("font_family", "DejaVu Sans"))
         f.setPointSize(int(self.ui_cfg.get("font_point_size", 16)))
         self.balloon.setFont(f)
+        # Constant markup around every chunk
+        self._html_prefix = (
+            f"<div style='text-align:center; font-size:{int(self.ui_cfg.get('font_point_size', 16))}pt;'>"
+        )
+        self._html_suffix = "</div>"
 
         self.overlay_layout.addWidget(self.balloon)
 
@@ -81,8 +119,36 @@ class UIRenderer(QWidget):
         self.fade_in.setEndValue(1.0)
         self.fade_in.setEasingCurve(QEasingCurve.InOutQuad)
 
+        # One timeline per chunk: fade in, hold, fade out. Each run ends with the
+        # balloon invisible, so the next chunk's text is swapped in before restarting.
+        self.hold = QPauseAnimation(self.chunk_duration_s * 1000)
+        self.chunk_cycle = QSequentialAnimationGroup(self)
+        self.chunk_cycle.addAnimation(self.fade_in)
+        self.chunk_cycle.addAnimation(self.hold)
+        self.chunk_cycle.addAnimation(self.fade_out)
+        self.chunk_cycle.finished.connect(self._show_next_chunk)
+
+        # Scaled backgrounds keyed by (path, width, height), most recent last
+        self._bg_cache: "OrderedDict[tuple, QPixmap]" = OrderedDict()
+        self._bg_cache_size = 8
+        self._bg_pending = set()
+        self._pool = QThreadPool.globalInstance()
+        self._bg_path = None
+        self._bg_pixmap_orig = None   # unscaled source, loaded lazily after a cache hit
+        self._bg_scaled = None        # last smooth-scaled pixmap, used for resize previews
+
+        # Coalesce resize events into a single smooth rescale
+        self._rescale_timer = QTimer(self)
+        self._rescale_timer.setSingleShot(True)
+        self._rescale_timer.setInterval(80)
+        self._rescale_timer.timeout.connect(self._do_rescale)
+
         self.chunks = []
+        self._chunk_html = []  # rendered once per chunk, parallel to self.chunks
         self._chunk_idx = -1
+        self._chunk_duration_ms = max(1000, self.chunk_duration_s * 1000)
+        self._streaming = False  # more chunks may still arrive via append_chunk
+        self._stalled = False    # playback caught up with the stream and is waiting
         self._rect_design = QRect(80, 80, 864, 560)
 
     # ----- Public API -----
@@ -90,15 +156,43 @@ class UIRenderer(QWidget):
         self.status.showMessage(text)
 
     def set_background(self, path: str):
-        if not path or not os.path.exists(path):
+        """Show path as the background; callers pass an existing file or None."""
+        if not path:
+            self._bg_path = None
+            self._bg_pixmap_orig = None
+            self._bg_scaled = None
             self.bg_label.clear()
             self.bg_label.setStyleSheet("background-color:black;")
             return
-        pm = QPixmap(path)
-        if not pm.isNull():
+        self._bg_path = path
+        self._bg_pixmap_orig = None
+        key = (path, self.width(), self.height())
+        scaled = self._bg_cache.get(key)
+        if scaled is None:
+            pm = QPixmap(path)
+            if pm.isNull():
+                return
+            self._bg_pixmap_orig = pm
             # Fit background to current window
             scaled = pm.scaled(self.size(), Qt.KeepAspectRatioByExpanding, Qt.SmoothTransformation)
-            self.bg_label.setPixmap(scaled)
+            self._cache_background(key, scaled)
+        else:
+            self._bg_cache.move_to_end(key)
+        self._bg_scaled = scaled
+        self.bg_label.setPixmap(scaled)
+
+    def preload_background(self, path: str):
+        """Decode and scale an upcoming background on the thread pool."""
+        if not path:
+            return
+        key = (path, self.width(), self.height())
+        if key in self._bg_cache or key in self._bg_pending:
+            return
+        self._bg_pending.add(key)
+        loader = PixmapLoader(path, self.size())
+        loader.signals.loaded.connect(self._on_background_loaded)
+        loader.signals.failed.connect(self._on_background_failed)
+        self._pool.start(loader)
 
     def set_balloon_rect_design(self, x: int, y: int, w: int, h: int):
         self._rect_design = QRect(int(x), int(y), int(w), int(h))
@@ -106,17 +200,67 @@ class UIRenderer(QWidget):
 
     def play_chunks(self, chunks, duration_s: int = None):
         self.chunks = list(chunks) if chunks else []
+        self._chunk_html = [self._wrap_html(c) for c in self.chunks]
         self._chunk_idx = -1
+        self._streaming = False
+        self._stalled = False
         if duration_s is None:
             duration_s = self.chunk_duration_s
         self._chunk_duration_ms = max(1000, int(duration_s * 1000))
+        self.chunk_cycle.stop()
+        self.hold.setDuration(self._chunk_duration_ms)
         if not self.chunks:
             self.balloon.setText("")
             QTimer.singleShot(300, self.chunkPlaybackFinished.emit)
             return
-        self._show_next_chunk(initial=True)
+        self._show_next_chunk()
+
+    def begin_stream(self, duration_s: int = None):
+        """Start an empty playlist that is filled incrementally via append_chunk."""
+        self.chunks = []
+        self._chunk_html = []
+        self._chunk_idx = -1
+        if duration_s is None:
+            duration_s = self.chunk_duration_s
+        self._chunk_duration_ms = max(1000, int(duration_s * 1000))
+        self.chunk_cycle.stop()
+        self.hold.setDuration(self._chunk_duration_ms)
+        self._streaming = True
+        self._stalled = True
+
+    def append_chunk(self, text: str):
+        self.chunks.append(text)
+        self._chunk_html.append(self._wrap_html(text))
+        if self._stalled:
+            self._stalled = False
+            self._show_next_chunk()
+
+    def end_stream(self):
+        self._streaming = False
+        if self._stalled:
+            self._stalled = False
+            if not self.chunks:
+                self.balloon.setText("")
+                QTimer.singleShot(300, self.chunkPlaybackFinished.emit)
+            else:
+                self.chunkPlaybackFinished.emit()
 
     # ----- Internals -----
+    def _on_background_loaded(self, path: str, size: QSize, img: QImage):
+        key = (path, size.width(), size.height())
+        self._bg_pending.discard(key)
+        self._cache_background(key, QPixmap.fromImage(img))
+
+    def _on_background_failed(self, path: str, size: QSize):
+        # Forget the attempt so the path can be preloaded again later
+        self._bg_pending.discard((path, size.width(), size.height()))
+
+    def _cache_background(self, key: tuple, pm: QPixmap):
+        self._bg_cache[key] = pm
+        self._bg_cache.move_to_end(key)
+        while len(self._bg_cache) > self._bg_cache_size:
+            self._bg_cache.popitem(last=False)
+
     def _apply_balloon_geometry(self):
         # Map design-space rect to current window size
         w, h = self.width(), self.height()
@@ -129,64 +273,51 @@ class UIRenderer(QWidget):
         gw = int(rw * w)
         gh = int(rh * h)
         self.overlay.setGeometry(QRect(gx, gy, gw, gh))
-        self._center_text_vertically()
-
-    def _center_text_vertically(self):
-        # Center text vertically by padding the viewport top margin
-        doc = self.balloon.document()
-        doc.setTextWidth(self.balloon.viewport().width() - 40)  # account for padding
-        dh = doc.size().height()
-        vh = self.balloon.viewport().height()
-        top_pad = max(0, int((vh - dh) / 2))
-        # Use viewportMargins to push content down
-        self.balloon.setViewportMargins(0, top_pad, 0, 0)
 
     def resizeEvent(self, e):
         super().resizeEvent(e)
-        # Rescale background
-        pm = self.bg_label.pixmap()
-        if pm:
-            scaled = pm.scaled(self.size(), Qt.KeepAspectRatioByExpanding, Qt.SmoothTransformation)
-            self.bg_label.setPixmap(scaled)
+        # Cheap preview now, smooth rescale once resizing settles
+        if self._bg_scaled is not None:
+            preview = self._bg_scaled.scaled(self.size(), Qt.KeepAspectRatioByExpanding, Qt.FastTransformation)
+            self.bg_label.setPixmap(preview)
+            self._rescale_timer.start()
         self._apply_balloon_geometry()
 
-    def _show_next_chunk(self, initial=False):
+    def _do_rescale(self):
+        if not self._bg_path:
+            return
+        key = (self._bg_path, self.width(), self.height())
+        scaled = self._bg_cache.get(key)
+        if scaled is None:
+            if self._bg_pixmap_orig is None:
+                self._bg_pixmap_orig = QPixmap(self._bg_path)
+            if self._bg_pixmap_orig.isNull():
+                return
+            # Always scale from the original so quality doesn't degrade across resizes
+            scaled = self._bg_pixmap_orig.scaled(self.size(), Qt.KeepAspectRatioByExpanding, Qt.SmoothTransformation)
+            self._cache_background(key, scaled)
+        else:
+            self._bg_cache.move_to_end(key)
+        self._bg_scaled = scaled
+        self.bg_label.setPixmap(scaled)
+
+    def _show_next_chunk(self):
         self._chunk_idx += 1
         if self._chunk_idx >= len(self.chunks):
+            if self._streaming:
+                # Caught up with the generator; resume from append_chunk
+                self._chunk_idx -= 1
+                self._stalled = True
+                return
             self.chunkPlaybackFinished.emit()
             return
-        text = self.chunks[self._chunk_idx]
-        def _swap():
-            self.balloon.setHtml(self._wrap_html(text))
-            self._center_text_vertically()
-            self.fade_in.finished.connect(_hold_then_fade)
-            self.fade_in.start()
-        def _hold_then_fade():
-            self.fade_in.finished.disconnect(_hold_then_fade)
-            QTimer.singleShot(self._chunk_duration_ms, self._start_fade_out)
-        if initial:
-            self.opacity.setOpacity(0.0)
-            _swap()
-        else:
-            self.fade_out.finished.connect(_swap)
-            self.fade_out.start()
-
-    def _start_fade_out(self):
-        self.fade_out.finished.disconnect()
-        self.fade_out.finished.connect(lambda: self._show_next_chunk(initial=False))
-        self.fade_out.start()
+        self.opacity.setOpacity(0.0)
+        self.balloon.setText(self._chunk_html[self._chunk_idx])
+        self.chunk_cycle.start()
 
     def _wrap_html(self, text: str) -> str:
-        safe_text = self._escape_html(text).replace("\n", "<br/>")
-        return (
-        f"<div style='text-align:center; font-size:{self.ui_cfg.get('font_point_size',16)}pt;'>"
-        f"{safe_text}"
-        "</div>"
-    )
+        return self._html_prefix + self._escape_html(text).replace("\n", "<br/>") + self._html_suffix
 
     @staticmethod
     def _escape_html(s: str) -> str:
-        return (s.replace("&", "&amp;")
-                 .replace("<", "&lt;")
-                 .replace(">", "&gt;")
-                 .replace("\"", "&quot;"))
\ No newline at end of file
+        return s.translate(_ESC_TABLE)
\ No newline at end of file